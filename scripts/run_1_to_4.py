@@ -1,24 +1,39 @@
-import runpy
+import importlib
+import sys
 import time
 import traceback
 from pathlib import Path
 
+# permite importar `src.utils.*` ao rodar `python scripts/run_all.py`
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+# Os scripts são importados como módulos e executados via `run()` no mesmo
+# processo: pandas/pyarrow/requests são importados uma única vez.
+# (os nomes começam com dígito, por isso `importlib` em vez de `import`)
+# Cada entrada é (script, script cujo resultado em memória ele recebe):
+# 02 processa os ZIPs entregues por 01, 03 e 04 partem do consolidado de 02 e
+# 05 agrega o resultado de 04, sem reler do disco os CSVs intermediários (que
+# continuam sendo gravados).
 SCRIPTS = [
-    'src/utils/01_download_ans.py',
-    'src/utils/02_processar_arquivos.py',
-    'src/utils/03_validar_dados.py',
-    'src/utils/04_enriquecer_dados.py',
-    'src/utils/05_agregar_despesas.py',
+    ('src.utils.01_download_ans', None),
+    ('src.utils.02_processar_arquivos', 'src.utils.01_download_ans'),
+    ('src.utils.03_validar_dados', 'src.utils.02_processar_arquivos'),
+    ('src.utils.04_enriquecer_dados', 'src.utils.02_processar_arquivos'),
+    ('src.utils.05_agregar_despesas', 'src.utils.04_enriquecer_dados'),
 ]
 
 def main():
     base = Path('.').resolve()
     print('Running scripts 1 → 5 from', base)
-    for s in SCRIPTS:
+    resultados = {}
+    for s, entrada in SCRIPTS:
         print('\n=== Running', s, '===')
         t0 = time.time()
         try:
-            runpy.run_path(s, run_name='__main__')
+            args = () if entrada is None else (resultados.get(entrada),)
+            resultados[s] = importlib.import_module(s).run(*args)
         except SystemExit as e:
             print(f"Script {s} exited with SystemExit: {e}")
             traceback.print_exc()
@@ -1,7 +1,13 @@
 import os
 import re
+import shutil
+import threading
 import requests
 from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from typing import List, Optional
+from urllib3.util.retry import Retry
 from urllib.parse import urljoin
 from pathlib import Path
 
@@ -20,9 +26,17 @@ Decisões técnicas (resumidas):
      em produção preferir configurar CA corretamente.
  - Baixamos os 3 arquivos ZIP mais recentes (por ordem) como critério
      simples e reprodutível para o teste.
+ - Os downloads rodam em paralelo (`ThreadPoolExecutor`) sobre uma única
+     `requests.Session` (keep-alive, pool de conexões e retentativas). Se o
+     servidor aceitar `Range`, arquivos grandes são baixados em segmentos de
+     8 MiB em paralelo, cada um gravado na sua posição do arquivo; se algum
+     segmento falhar (ex.: o servidor ignora o `Range`), os demais são
+     cancelados e o arquivo é baixado de novo em uma única requisição.
 
 Observação sobre repetibilidade:
  - O script é idempotente: não baixa arquivos que já existam em `data/raw`.
+     O download é feito em um arquivo `.part` e só é renomeado ao final, então
+     uma interrupção não deixa um ZIP incompleto que seria considerado baixado.
 """
 
 # Configurações
@@ -30,12 +44,37 @@ BASE_URL = "https://dadosabertos.ans.gov.br/FTP/PDA/demonstracoes_contabeis/"
 RAW_DIR = Path("data/raw")
 RAW_DIR.mkdir(parents=True, exist_ok=True)
 
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+}
+
+# Paralelismo dos downloads: arquivos simultâneos e segmentos (Range) por arquivo
+DOWNLOADS_SIMULTANEOS = 3
+SEGMENTOS_SIMULTANEOS = 4
+SEGMENTO_BYTES = 8 * 1024 * 1024
+
+# Tamanho do bloco copiado da resposta HTTP para o disco (e do buffer de escrita)
+BUFFER_BYTES = 1024 * 1024
+
+
+def criar_sessao() -> requests.Session:
+    """Cria uma sessão HTTP com keep-alive, pool de conexões e retentativas."""
+    sessao = requests.Session()
+    sessao.headers.update(HEADERS)
+    # verify=False ignora erros de certificado SSL comuns em sites do governo
+    sessao.verify = False
+    adapter = HTTPAdapter(
+        pool_connections=8,
+        pool_maxsize=DOWNLOADS_SIMULTANEOS * SEGMENTOS_SIMULTANEOS,
+        max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504)),
+    )
+    sessao.mount('https://', adapter)
+    sessao.mount('http://', adapter)
+    return sessao
+
+
 def listar_links_v2(url):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Cache-Control': 'no-cache',
-        'Pragma': 'no-cache'
-    }
+    headers = {**HEADERS, 'Cache-Control': 'no-cache', 'Pragma': 'no-cache'}
     try:
         # verify=False ignora erros de certificado SSL comuns em sites do governo
         response = requests.get(url, timeout=20, headers=headers, verify=False)
@@ -52,7 +91,8 @@ def listar_links_v2(url):
         print(f"Erro ao acessar {url}: {e}")
         return []
 
-def main():
+def main() -> List[Path]:
+    """Baixa os ZIPs mais recentes e retorna os caminhos disponíveis em `data/raw`."""
     print("--- Verificação Geral de Arquivos ---")
     
     # 1. Detectar o ano mais recente disponível sob BASE_URL
@@ -69,7 +109,7 @@ def main():
 
     if not years:
         print("Nenhum diretório de ano encontrado em BASE_URL. Abortando.")
-        return
+        return []
 
     max_year = max(years)
     url_year = urljoin(BASE_URL, f"{max_year}/")
@@ -91,33 +131,130 @@ def main():
     arquivos_finais = sorted(encontrados, reverse=True)[:3]
 
     print(f"\n--- Selecionados para Download ({len(arquivos_finais)}) ---")
-    for url in arquivos_finais:
-        nome = url.split('/')[-1]
-        print(f"Baixando: {nome}")
-        destino = RAW_DIR / nome
-        baixar_arquivo(url, destino)
+    sessao = criar_sessao()
+    with ThreadPoolExecutor(max_workers=DOWNLOADS_SIMULTANEOS) as executor:
+        futuros = []
+        for url in arquivos_finais:
+            nome = url.split('/')[-1]
+            print(f"Baixando: {nome}")
+            destino = RAW_DIR / nome
+            futuros.append(executor.submit(baixar_arquivo, url, destino, sessao))
+        baixados = [futuro.result() for futuro in futuros]
+    return [destino for destino in baixados if destino is not None]
+
+
+def _tamanho_se_aceita_range(sessao: requests.Session, url: str) -> Optional[int]:
+    """Retorna o tamanho do arquivo se o servidor aceitar requisições `Range`."""
+    try:
+        r = sessao.head(url, timeout=20, allow_redirects=True)
+        r.raise_for_status()
+    except Exception:
+        return None
+    if r.headers.get('Accept-Ranges', '').lower() != 'bytes':
+        return None
+    try:
+        return int(r.headers['Content-Length'])
+    except (KeyError, ValueError):
+        return None
+
+
+def _baixar_segmento(sessao: requests.Session, url: str, destino: Path, inicio: int, fim: int):
+    """Baixa os bytes [inicio, fim] e grava na mesma posição de `destino`."""
+    headers = {'Range': f'bytes={inicio}-{fim}'}
+    with sessao.get(url, stream=True, timeout=60, headers=headers) as r:
+        r.raise_for_status()
+        if r.status_code != 206:
+            raise ValueError(f"servidor ignorou o Range {inicio}-{fim} (status {r.status_code})")
+        r.raw.decode_content = True
+        with open(destino, 'r+b', buffering=BUFFER_BYTES) as f:
+            f.seek(inicio)
+            shutil.copyfileobj(r.raw, f, length=BUFFER_BYTES)
+            gravados = f.tell() - inicio
+    if gravados != fim - inicio + 1:
+        raise ValueError(f"segmento {inicio}-{fim} incompleto ({gravados} bytes)")
 
 
-def baixar_arquivo(url: str, destino: Path):
-    """Baixa um arquivo .zip para `destino` se ele não existir."""
+def _baixar_em_segmentos(sessao: requests.Session, url: str, destino: Path, tamanho: int):
+    """Baixa `url` em segmentos paralelos de `SEGMENTO_BYTES` via `Range`.
+
+    Na primeira falha, os segmentos ainda não iniciados são descartados e o erro
+    é propagado (sem baixar o restante do arquivo).
+    """
+    # pré-aloca o arquivo para que cada segmento grave na sua posição
+    with open(destino, 'wb') as f:
+        f.truncate(tamanho)
+
+    falhou = threading.Event()
+
+    def segmento(inicio: int):
+        if falhou.is_set():
+            return
+        try:
+            _baixar_segmento(sessao, url, destino, inicio, min(inicio + SEGMENTO_BYTES, tamanho) - 1)
+        except BaseException:
+            falhou.set()
+            raise
+
+    executor = ThreadPoolExecutor(max_workers=SEGMENTOS_SIMULTANEOS)
+    try:
+        futuros = [executor.submit(segmento, inicio) for inicio in range(0, tamanho, SEGMENTO_BYTES)]
+        # na ordem de conclusão: a falha de qualquer segmento interrompe a espera
+        for futuro in as_completed(futuros):
+            futuro.result()
+    except BaseException:
+        falhou.set()
+        executor.shutdown(cancel_futures=True)
+        raise
+    executor.shutdown()
+
+
+def _baixar_stream(sessao: requests.Session, url: str, destino: Path):
+    """Baixa `url` em uma única requisição, gravando em `destino`."""
+    with sessao.get(url, stream=True, timeout=60) as r:
+        r.raise_for_status()
+        # copia em blocos de 1 MiB direto do socket (menos iterações e syscalls)
+        r.raw.decode_content = True
+        with open(destino, 'wb', buffering=BUFFER_BYTES) as f:
+            shutil.copyfileobj(r.raw, f, length=BUFFER_BYTES)
+
+
+def baixar_arquivo(url: str, destino: Path, sessao: Optional[requests.Session] = None) -> Optional[Path]:
+    """Baixa um arquivo .zip para `destino` se ele não existir.
+
+    Retorna `destino` se o arquivo estiver disponível ao final, ou None em caso de falha.
+    """
     if destino.exists():
         print(f"Já existe: {destino.name}")
-        return
+        return destino
 
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-    }
+    sessao = sessao or criar_sessao()
+    parcial = destino.with_name(destino.name + '.part')
     try:
-        with requests.get(url, stream=True, timeout=60, headers=headers, verify=False) as r:
-            r.raise_for_status()
-            with open(destino, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
+        tamanho = _tamanho_se_aceita_range(sessao, url)
+        if tamanho and tamanho > SEGMENTO_BYTES:
+            try:
+                _baixar_em_segmentos(sessao, url, parcial, tamanho)
+            except Exception as e:
+                # ex.: servidor anuncia `Accept-Ranges` mas responde 200 ao Range;
+                # tentamos de novo em uma única requisição
+                print(f"Download em segmentos falhou ({e}); baixando em uma única requisição")
+                parcial.unlink(missing_ok=True)
+                _baixar_stream(sessao, url, parcial)
+        else:
+            _baixar_stream(sessao, url, parcial)
+        parcial.replace(destino)
         print(f"Salvo: {destino}")
+        return destino
     except Exception as e:
+        parcial.unlink(missing_ok=True)
         print(f"Falha ao baixar {url}: {e}")
+        return None
+
+
+def run():
+    """Executa a etapa 01 (download dos ZIPs da ANS)."""
+    return main()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    run()
\ No newline at end of file
@@ -1,11 +1,14 @@
 import pandas as pd
 import zipfile
+import codecs
 import re
-import tempfile
+import io
 import os
 import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 
 """
@@ -18,9 +21,24 @@ Propósito:
 
 Decisões técnicas e justificativa:
  - Processamento incremental (arquivo a arquivo) em vez de carregar tudo
-     na memória: reduz uso de memória, permite retomada parcial e é mais
-     seguro para coleções grandes (trade-off: foco em I/O e latência).
- - Tentamos múltiplos encodings e separadores para lidar com a heterogeneidade
+     na memória: cada tabela é gravada e descartada assim que fica pronta, o
+     que reduz uso de memória e é mais seguro para coleções grandes. Só quando
+     chamada pelo pipeline (`run`) a etapa também guarda as tabelas para
+     entregar o consolidado em memória à etapa seguinte.
+ - Cada arquivo de cada ZIP é lido em um processo separado
+     (`ProcessPoolExecutor`): descompressão e parsing pelo pandas são
+     independentes entre arquivos e escalam com o número de núcleos. Cada
+     worker mantém seu próprio handle de cada ZIP (o diretório central é lido
+     uma vez por worker, não a cada arquivo) e os maiores arquivos são
+     submetidos primeiro. Apenas o processo principal grava o CSV final,
+     evitando escrita intercalada.
+ - Os arquivos são lidos direto do ZIP (`ZipFile.open`) em vez de extraídos
+     para um diretório temporário: evita gravar e reler do disco o conteúdo
+     descomprimido.
+ - Separador e encoding são detectados a partir de uma amostra dos primeiros
+     64 KiB, permitindo uma única leitura com o parser em C do pandas (bem
+     mais rápido que o `engine="python"`). Se a detecção falhar, voltamos a
+     tentar múltiplos encodings e separadores para lidar com a heterogeneidade
      dos arquivos (CSV/TXT) encontrados nos ZIPs.
  - Heurísticas simples determinam se uma tabela é de despesas (nomes de
      colunas e padrões de valores). Isso é robusto o suficiente para o teste
@@ -34,17 +52,43 @@ OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
 # Arquivo de saída consolidado (escrevemos incrementalmente)
 CSV_FINAL = OUTPUT_DIR / "consolidado_despesas.csv"
+COLUNAS_SAIDA = ["RegistroANS", "Trimestre", "Ano", "ValorDespesas"]
+
+# Buffer de escrita do CSV consolidado (aberto uma única vez)
+BUFFER_ESCRITA = 1 << 20
+
+# Extensões consideradas candidatas a tabela dentro dos ZIPs
+EXTENSOES_TABELA = {".csv", ".txt", ".xls", ".xlsx"}
+
+# Separadores candidatos (em ordem de preferência) e tamanho da amostra para detecção
+SEPARADORES = [";", ",", "\t", "|"]
+TAMANHO_AMOSTRA = 64 * 1024
+
+# Padrões de ano/trimestre no nome dos arquivos (compilados uma única vez)
+_RE_TQ = re.compile(r"([1-4])T(\d{4})", re.IGNORECASE)
+_RE_YQ = re.compile(r"(\d{4})[^0-9]{0,3}([1-4])(?:[_\- ]|$)", re.IGNORECASE)
+_RE_YYYYMM = re.compile(r"(\d{6})")
+
+# Número de processos usados para extrair/ler os arquivos dos ZIPs; no Windows
+# o `ProcessPoolExecutor` aceita no máximo 61 (limite do WaitForMultipleObjects)
+MAX_WORKERS = os.cpu_count() or 1
+if sys.platform == "win32":
+    MAX_WORKERS = min(MAX_WORKERS, 61)
+
+# Handles de ZIP abertos em cada processo worker (um por arquivo, reaproveitado
+# entre as tarefas daquele ZIP; cada worker lê/descomprime de forma independente)
+_ZIPS_ABERTOS: Dict[Path, zipfile.ZipFile] = {}
 
 
 def _extract_year_quarter_from_name(name: str) -> Optional[Tuple[int, int]]:
     # busca por padrões como '1T2025' ou '2025_1_trimestre' ou 'YYYYMM'
-    m = re.search(r"([1-4])T(\d{4})", name, flags=re.IGNORECASE)
+    m = _RE_TQ.search(name)
     if m:
         return int(m.group(2)), int(m.group(1))
-    m = re.search(r"(\d{4})[^0-9]{0,3}([1-4])(?:[_\- ]|$)", name, flags=re.IGNORECASE)
+    m = _RE_YQ.search(name)
     if m:
         return int(m.group(1)), int(m.group(2))
-    m = re.search(r"(\d{6})", name)
+    m = _RE_YYYYMM.search(name)
     if m:
         y = int(m.group(1)[:4]); mon = int(m.group(1)[4:6])
         if 1 <= mon <= 12:
@@ -52,23 +96,57 @@ def _extract_year_quarter_from_name(name: str) -> Optional[Tuple[int, int]]:
     return None
 
 
-def _try_read_table(path: Path) -> Optional[pd.DataFrame]:
-    """Tenta ler um arquivo CSV/TXT/XLSX retornando DataFrame ou None."""
-    lower = path.suffix.lower()
+def _sniff_csv(amostra: bytes) -> Optional[Tuple[str, str]]:
+    """Detecta (separador, encoding) a partir dos primeiros bytes do arquivo."""
+    try:
+        # decoder incremental tolera um caractere multibyte cortado no fim da amostra
+        texto = codecs.getincrementaldecoder("utf-8")().decode(amostra, final=False)
+        enc = "utf-8"
+    except UnicodeDecodeError:
+        texto = amostra.decode("latin-1")
+        enc = "latin-1"
+
+    # o cabeçalho é a linha mais confiável para contar separadores
+    cabecalho = texto.splitlines()[0] if texto else ""
+    contagens = {sep: cabecalho.count(sep) for sep in SEPARADORES}
+    sep = max(SEPARADORES, key=lambda s: contagens[s])
+    if contagens[sep] == 0:
+        return None
+    return sep, enc
+
+
+def _try_read_table(z: zipfile.ZipFile, info: zipfile.ZipInfo) -> Optional[pd.DataFrame]:
+    """Tenta ler um arquivo CSV/TXT/XLSX de dentro do ZIP retornando DataFrame ou None."""
+    lower = Path(info.filename).suffix.lower()
     if lower in {".xls", ".xlsx"}:
         try:
-            return pd.read_excel(path, dtype=str)
+            return pd.read_excel(io.BytesIO(z.read(info)), dtype=str)
         except Exception:
             return None
 
-    # para CSV/TXT tentamos múltiplos separadores e encodings
+    # caminho rápido: detectar separador/encoding e ler uma única vez com o parser C
+    try:
+        with z.open(info) as f:
+            detectado = _sniff_csv(f.read(TAMANHO_AMOSTRA))
+        if detectado:
+            sep, enc = detectado
+            with z.open(info) as f:
+                df = pd.read_csv(f, sep=sep, encoding=enc, dtype=str, engine="c",
+                                 low_memory=False, on_bad_lines="skip")
+            if df.shape[1] > 1:
+                return df
+    except Exception:
+        pass
+
+    # fallback: tentamos múltiplos separadores e encodings
     # tentamos alguns encodings comuns no Brasil e em bases governamentais
+    # (cada tentativa reabre o stream, pois o anterior já foi consumido)
     encodings = ["utf-8", "latin-1", "cp1252"]
-    seps = [";", ",", "\t", "|"]
     for enc in encodings:
-        for sep in seps:
+        for sep in SEPARADORES:
             try:
-                df = pd.read_csv(path, sep=sep, encoding=enc, dtype=str, engine="python")
+                with z.open(info) as f:
+                    df = pd.read_csv(f, sep=sep, encoding=enc, dtype=str, engine="python")
                 if df.shape[1] > 1:
                     return df
             except Exception:
@@ -119,15 +197,16 @@ def _normalize_and_extract(df: pd.DataFrame, ano: str, trimestre: str) -> Option
     df_sub.columns = ["RegistroANS", "ValorDespesas"]
 
     # limpar e converter ValorDespesas
+    # (strings em Arrow: a limpeza roda nos kernels em C++ em vez de célula a célula)
     df_sub["ValorDespesas"] = (
-        df_sub["ValorDespesas"].astype(str)
+        df_sub["ValorDespesas"].astype("string[pyarrow]")
         .str.replace(r"[^0-9,\.\-]", "", regex=True)
-        .str.replace(",", ".")
+        .str.replace(",", ".", regex=False)
     )
     try:
-        df_sub["ValorDespesas"] = pd.to_numeric(df_sub["ValorDespesas"], errors="coerce")
+        df_sub["ValorDespesas"] = pd.to_numeric(df_sub["ValorDespesas"], errors="coerce").astype("float64")
     except Exception:
-        df_sub["ValorDespesas"] = pd.to_numeric(df_sub["ValorDespesas"].str.replace("." , "", regex=False), errors="coerce")
+        df_sub["ValorDespesas"] = pd.to_numeric(df_sub["ValorDespesas"].str.replace("." , "", regex=False), errors="coerce").astype("float64")
 
     df_sub["Ano"] = ano
     df_sub["Trimestre"] = trimestre
@@ -136,17 +215,59 @@ def _normalize_and_extract(df: pd.DataFrame, ano: str, trimestre: str) -> Option
     df_sub = df_sub.dropna(subset=["ValorDespesas"]).reset_index(drop=True)
     if df_sub.empty:
         return None
-    return df_sub[["RegistroANS", "Trimestre", "Ano", "ValorDespesas"]]
+    return df_sub[COLUNAS_SAIDA]
+
+
+def _zip_do_worker(caminho_zip: Path) -> zipfile.ZipFile:
+    """Retorna o handle do ZIP neste processo, abrindo-o na primeira tarefa."""
+    z = _ZIPS_ABERTOS.get(caminho_zip)
+    if z is None:
+        z = _ZIPS_ABERTOS[caminho_zip] = zipfile.ZipFile(caminho_zip, 'r')
+    return z
 
 
-def processar_arquivos():
-    """Processa incrementalmente os arquivos ZIP em `data/raw` e gera CSV consolidado.
+def _processar_membro(caminho_zip: Path, membro: str, ano: str, trimestre: str) -> Tuple[Optional[pd.DataFrame], str]:
+    """Lê e processa um único arquivo de um ZIP (executado em processo worker).
 
-    Strategy: iteramos cada ZIP, extraímos temporariamente, processamos cada arquivo
-    (CSV/TXT/XLSX) um a um, identificamos tabelas de despesas, normalizamos e
-    escrevemos incrementalmente em `CSV_FINAL`.
+    Retorna o DataFrame normalizado (ou None) e a mensagem de log correspondente.
     """
-    arquivos_zip = sorted(RAW_DIR.glob("*.zip"))
+    fname = Path(membro).name
+    try:
+        z = _zip_do_worker(caminho_zip)
+        df = _try_read_table(z, z.getinfo(membro))
+    except Exception as e:
+        return None, f"Erro ao ler {fname} do ZIP: {e}"
+
+    if df is None:
+        return None, f"Não foi possível ler {fname}"
+
+    if not _is_expense_table(df):
+        return None, f"Não é tabela de despesas (pular): {fname}"
+
+    dfn = _normalize_and_extract(df, ano, trimestre)
+    if dfn is None:
+        return None, f"Não conseguiu extrair colunas necessárias em {fname}"
+    return dfn, f"Gravado {len(dfn)} linhas de {fname}"
+
+
+def processar_arquivos(arquivos_zip: Optional[List[Path]] = None,
+                       retornar_df: bool = False) -> Optional[pd.DataFrame]:
+    """Processa os arquivos ZIP em `data/raw` em paralelo e gera CSV consolidado.
+
+    Strategy: listamos os arquivos (CSV/TXT/XLSX) de todos os ZIPs e submetemos
+    cada um a um pool de processos, que o lê direto do ZIP, identifica tabelas de
+    despesas e normaliza. O processo principal coleta os resultados conforme
+    ficam prontos e escreve incrementalmente em `CSV_FINAL`, por um único
+    handle com buffer (sem reabrir o arquivo a cada tabela).
+
+    `arquivos_zip` permite processar exatamente os ZIPs entregues pela etapa 01;
+    sem ele, processamos todos os ZIPs de `data/raw`.
+
+    Com `retornar_df=True`, retorna também o consolidado em memória (ou None se
+    nada foi gerado), para que as etapas seguintes não precisem reler o CSV do
+    disco; sem ele, cada tabela é descartada logo após ser gravada.
+    """
+    arquivos_zip = sorted(arquivos_zip) if arquivos_zip else sorted(RAW_DIR.glob("*.zip"))
     if not arquivos_zip:
         print("Nenhum ZIP encontrado em data/raw")
         return
@@ -155,56 +276,79 @@ def processar_arquivos():
     if CSV_FINAL.exists():
         CSV_FINAL.unlink()
 
-    primeira_escrita = True
-
+    tarefas = []
     for caminho_zip in arquivos_zip:
         print(f"--- Processando ZIP: {caminho_zip.name} ---")
         yq = _extract_year_quarter_from_name(caminho_zip.name)
         ano = str(yq[0]) if yq else "N/A"
         trimestre = str(yq[1]) if yq else "N/A"
 
-        with tempfile.TemporaryDirectory() as td:
+        try:
+            with zipfile.ZipFile(caminho_zip, 'r') as z:
+                infos = z.infolist()
+        except Exception as e:
+            print(f"Erro ao abrir {caminho_zip.name}: {e}")
+            continue
+
+        for info in infos:
+            # ignorar diretórios e arquivos de sistema
+            if info.is_dir() or info.filename.startswith("__MACOSX"):
+                continue
+            fname = Path(info.filename).name
+            if Path(fname).suffix.lower() not in EXTENSOES_TABELA:
+                print(f"  Ignorado (não é tabela): {fname}")
+                continue
+            print(f"  Lendo: {fname}")
+            tarefas.append((info.file_size, (caminho_zip, info.filename, ano, trimestre)))
+
+    # maiores primeiro: os arquivos grandes (que dominam o tempo) começam cedo e
+    # os pequenos preenchem os workers livres no final
+    tarefas = [t for _, t in sorted(tarefas, key=lambda x: x[0], reverse=True)]
+
+    partes = []
+    linhas = 0
+
+    with open(CSV_FINAL, 'w', buffering=BUFFER_ESCRITA, encoding='utf-8-sig', newline='') as fh, \
+            ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        fh.write(",".join(COLUNAS_SAIDA) + "\n")
+        futuros = {executor.submit(_processar_membro, *t): t for t in tarefas}
+        for futuro in as_completed(futuros):
+            # soltar a referência ao futuro (e ao DataFrame que ele guarda)
+            caminho_zip, membro, _, _ = futuros.pop(futuro)
+            fname = Path(membro).name
             try:
-                with zipfile.ZipFile(caminho_zip, 'r') as z:
-                    z.extractall(td)
+                dfn, msg = futuro.result()
             except Exception as e:
-                print(f"Erro ao extrair {caminho_zip.name}: {e}")
+                print(f"    Erro ao processar {caminho_zip.name}/{fname}: {e}")
                 continue
 
-            # percorre arquivos extraídos
-            for root, _, files in os.walk(td):
-                for fname in files:
-                    fpath = Path(root) / fname
-                    # ignorar arquivos de sistema
-                    if "__MACOSX" in str(fpath):
-                        continue
-                    print(f"  Lendo: {fname}")
-                    df = _try_read_table(fpath)
-                    if df is None:
-                        print(f"    Não foi possível ler {fname}")
-                        continue
-
-                    if not _is_expense_table(df):
-                        print(f"    Não é tabela de despesas (pular): {fname}")
-                        continue
-
-                    dfn = _normalize_and_extract(df, ano, trimestre)
-                    if dfn is None:
-                        print(f"    Não conseguiu extrair colunas necessárias em {fname}")
-                        continue
-
-                    # escrever incrementalmente
-                    try:
-                        dfn.to_csv(CSV_FINAL, mode='a', index=False, header=primeira_escrita, encoding='utf-8-sig')
-                        primeira_escrita = False
-                        print(f"    Gravado {len(dfn)} linhas de {fname}")
-                    except Exception as e:
-                        print(f"    Erro ao gravar dados de {fname}: {e}")
+            print(f"  [{caminho_zip.name}] {msg}")
+            if dfn is None:
+                continue
 
-    if CSV_FINAL.exists():
-        print(f"Consolidado gerado: {CSV_FINAL}")
-    else:
+            # escrever incrementalmente (somente o processo principal grava)
+            try:
+                dfn.to_csv(fh, index=False, header=False, lineterminator='\n')
+                linhas += len(dfn)
+                if retornar_df:
+                    partes.append(dfn)
+            except Exception as e:
+                print(f"    Erro ao gravar dados de {fname}: {e}")
+
+    if not linhas:
+        # só o cabeçalho foi escrito: não deixar um consolidado vazio
+        CSV_FINAL.unlink()
         print("Nenhum dado de despesa consolidado gerado.")
+        return None
+
+    print(f"Consolidado gerado: {CSV_FINAL}")
+    if retornar_df:
+        return pd.concat(partes, ignore_index=True)
+
+
+def run(arquivos_zip: Optional[List[Path]] = None):
+    """Executa a etapa 02 (consolidação dos ZIPs em `CSV_FINAL`)."""
+    return processar_arquivos(arquivos_zip, retornar_df=True)
 
 
 if __name__ == "__main__":
@@ -6,9 +6,9 @@ Propósito:
      os dados mais confiáveis para análises posteriores.
 
 Validações e decisões:
- - CNPJ: validação de formato (14 dígitos). Para o escopo do teste, isso
-     detecta a maioria dos problemas de entrada; validação completa de dígitos
-     de verificação pode ser adicionada se necessário.
+ - CNPJ: validação de formato (14 dígitos) e dos dois dígitos verificadores
+     (módulo 11), calculados de forma vetorizada com numpy. O resultado fica
+     em `CNPJ_Valido`; os registros não são excluídos.
  - Razão social: sinalizamos registros sem `RazaoSocial` em vez de excluí-los,
      preservando dados para posterior enriquecimento.
  - Valores: removemos registros com `ValorDespesas` <= 0 para focar análises
@@ -16,34 +16,77 @@ Validações e decisões:
 
 Formato de saída:
  - CSV com encoding `utf-8-sig` para compatibilidade com Excel.
+ - Cópia em Parquet (`dados_validados.parquet`, zstd) para a etapa 05, que lê
+     só as colunas de que precisa e já recebe os tipos corretos.
 """
 
+import numpy as np
 import pandas as pd
 from pathlib import Path
+from typing import Optional
 
 # Configurações
 INPUT_PATH = Path("data/output/consolidado_despesas.csv")
 OUTPUT_PATH = Path("data/processed/dados_validados.csv")
+OUTPUT_PARQUET = OUTPUT_PATH.with_suffix(".parquet")
 OUTPUT_PATH.parent.mkdir(parents=True, exist_ok=True)
 
-def validar_cnpj(cnpj):
-    # Lógica simples de conferência de tamanho
-    # Para um teste de estagiário, verificar se tem 14 dígitos já é um bom começo
-    # normalizar e checar comprimento (não fazemos dígitos verificadores aqui)
-    cnpj = str(cnpj).replace(".", "").replace("/", "").replace("-", "")
-    return len(cnpj) == 14
+# remove a pontuação do CNPJ em uma única passada (versão escalar)
+_CNPJ_STRIP = str.maketrans('', '', './-')
+
+# pesos dos dois dígitos verificadores do CNPJ (módulo 11)
+_PESOS_DV1 = np.array([5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+_PESOS_DV2 = np.array([6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
 
-def executar_validacao():
+def _digitos_verificadores_ok(digitos):
+    """Confere os DVs de uma matriz (N, 14) de dígitos; retorna vetor booleano."""
+    resto = (digitos[:, :12] @ _PESOS_DV1) % 11
+    dv1 = np.where(resto < 2, 0, 11 - resto)
+    resto = (digitos[:, :13] @ _PESOS_DV2) % 11
+    dv2 = np.where(resto < 2, 0, 11 - resto)
+    # sequências repetidas (ex.: 00000000000000) passam no cálculo, mas são inválidas
+    repetido = (digitos == digitos[:, :1]).all(axis=1)
+    return (digitos[:, 12] == dv1) & (digitos[:, 13] == dv2) & ~repetido
+
+def validar_cnpj(cnpj):
+    # Versão escalar (valores avulsos); o DataFrame usa `validar_cnpjs`
+    # normalizar, checar 14 dígitos e conferir os dígitos verificadores
+    cnpj = str(cnpj).translate(_CNPJ_STRIP)
+    if len(cnpj) != 14 or not (cnpj.isascii() and cnpj.isdigit()):
+        return False
+    return bool(_digitos_verificadores_ok(np.array([[int(c) for c in cnpj]]))[0])
+
+def validar_cnpjs(cnpjs):
+    """Mesma regra de `validar_cnpj`, vetorizada sobre uma Series."""
+    # uma única passada de regex sobre strings em Arrow (kernel C++;
+    # `.str.translate` cairia num loop Python)
+    limpos = cnpjs.astype(str).astype('string[pyarrow]').str.replace(r'[./-]', '', regex=True)
+    formato_ok = limpos.str.fullmatch(r'\d{14}').fillna(False).astype(bool)
+
+    valido = pd.Series(False, index=cnpjs.index)
+    if formato_ok.any():
+        # matriz (N, 14) de dígitos direto dos bytes ASCII, sem loop por linha
+        texto = ''.join(limpos[formato_ok].tolist()).encode('ascii')
+        digitos = np.frombuffer(texto, dtype=np.uint8).reshape(-1, 14).astype(np.int64) - ord('0')
+        valido[formato_ok] = _digitos_verificadores_ok(digitos)
+    return valido
+
+def executar_validacao(df: Optional[pd.DataFrame] = None):
+    """Valida o consolidado; usa `df` se já estiver em memória, senão lê `INPUT_PATH`."""
     print("--- Iniciando Validação de Dados (Item 2.1) ---")
 
-    try:
-        df = pd.read_csv(INPUT_PATH)
-    except FileNotFoundError:
-        print(f"Arquivo de entrada não encontrado: {INPUT_PATH}")
-        return
-    except Exception as e:
-        print(f"Erro ao ler {INPUT_PATH}: {e}")
-        return
+    if df is not None:
+        # cópia rasa: as colunas adicionadas aqui não vazam para quem chamou
+        df = df.copy(deep=False)
+    else:
+        try:
+            df = pd.read_csv(INPUT_PATH)
+        except FileNotFoundError:
+            print(f"Arquivo de entrada não encontrado: {INPUT_PATH}")
+            return
+        except Exception as e:
+            print(f"Erro ao ler {INPUT_PATH}: {e}")
+            return
 
     cols = set(df.columns)
 
@@ -79,9 +122,12 @@ def executar_validacao():
     else:
         print("Atenção: coluna 'RazaoSocial' não encontrada — pulando essa validação.")
 
-    # 2. Validação de CNPJ (Apenas formato para simplificar)
+    # 2. Validação de CNPJ (formato + dígitos verificadores)
     if 'CNPJ' in cols:
-        df['CNPJ_Valido'] = df['CNPJ'].apply(validar_cnpj)
+        df['CNPJ_Valido'] = validar_cnpjs(df['CNPJ'])
+        invalidos = (~df['CNPJ_Valido']).sum()
+        if invalidos:
+            print(f"Atenção: {invalidos} registros com CNPJ inválido (ou ausente).")
     else:
         print("Atenção: coluna 'CNPJ' não encontrada — marcando CNPJ_Valido=False para todos.")
         df['CNPJ_Valido'] = False
@@ -110,9 +156,16 @@ def executar_validacao():
     # Salvar para a próxima etapa
     try:
         output_df.to_csv(OUTPUT_PATH, index=False, encoding='utf-8-sig')
-        print(f"Dados validados salvos em: {OUTPUT_PATH}")
+        output_df.to_parquet(OUTPUT_PARQUET, engine='pyarrow', compression='zstd', row_group_size=200_000)
+        print(f"Dados validados salvos em: {OUTPUT_PATH} (e {OUTPUT_PARQUET.name})")
     except Exception as e:
         print(f"Erro ao salvar {OUTPUT_PATH}: {e}")
 
+    return output_df
+
+def run(df: Optional[pd.DataFrame] = None):
+    """Executa a etapa 03 (validação do consolidado)."""
+    return executar_validacao(df)
+
 if __name__ == "__main__":
-    executar_validacao()
\ No newline at end of file
+    run()
\ No newline at end of file
@@ -7,31 +7,46 @@ Propósito:
      operadoras ativas.
 
 Decisões técnicas e heurísticas importantes:
+ - O cadastro é mantido em cache em `data/raw/Relatorio_cadop.csv` junto
+     com o `ETag`/`Last-Modified` da resposta; nas execuções seguintes fazemos
+     um GET condicional e, se o servidor responder 304, usamos o cache.
  - Leitura robusta do cadastro: tentamos `utf-8` e caímos para `latin-1`
-     porque as bases governamentais às vezes usam encodings distintos.
+     porque as bases governamentais às vezes usam encodings distintos. O
+     parsing usa o leitor CSV do PyArrow, com todas as colunas como texto.
  - Aplicamos uma heurística de correção de "mojibake" (latin1→utf8) em
      campos de texto para evitar nomes com caracteres corrompidos.
- - O merge é feito por `RegistroANS` quando possível; quando isso falha
-     procuramos outras colunas candidatas (robustez contra nomes de coluna
-     diferentes entre dumps).
- - Saída com `utf-8-sig` para facilitar abertura em Excel/Windows.
+ - O merge é feito por `RegistroANS` convertido para inteiro (`Int64`) dos
+     dois lados: o hash join sobre inteiros é bem mais rápido que sobre
+     strings e zeros à esquerda deixam de impedir o casamento. Quando a
+     coluna de registro não é óbvia, procuramos outras colunas candidatas
+     (robustez contra nomes de coluna diferentes entre dumps).
+ - Saída com `utf-8-sig` para facilitar abertura em Excel/Windows, mais uma
+     cópia em Parquet (zstd) usada como entrada colunar pela etapa 05.
 """
 
 import pandas as pd
 import requests
+import csv
 import io
+import json
+import pyarrow as pa
+from pyarrow import csv as pa_csv
 from pathlib import Path
+from typing import Optional
 import re
 
 
+# heurística: sequências como Ã, Â geralmente indicam double-encoding
+_MOJIBAKE_PAT = re.compile(r'[ÃÂ]')
+
+
 def _fix_mojibake_text(s: str) -> str:
     """Tentativa simples de corrigir mojibake comum: re-decode latin1->utf-8.
     Se não houver padrão suspeito, retorna o original.
     """
     if not isinstance(s, str):
         return s
-    # heurística: sequências como Ã, Â geralmente indicam double-encoding
-    if re.search(r'[ÃÂ]', s):
+    if _MOJIBAKE_PAT.search(s):
         try:
             return s.encode('latin-1').decode('utf-8')
         except Exception:
@@ -43,33 +58,116 @@ def _fix_mojibake_text(s: str) -> str:
 URL_CADASTRO = "https://dadosabertos.ans.gov.br/FTP/PDA/operadoras_de_plano_de_saude_ativas/Relatorio_cadop.csv"
 INPUT_RAW = Path("data/output/consolidado_despesas.csv") # Arquivo que tem o RegistroANS
 OUTPUT_FINAL = Path("data/processed/dados_validados.csv")
+OUTPUT_PARQUET = OUTPUT_FINAL.with_suffix(".parquet")
+# Cache local do cadastro e dos cabeçalhos de validação (ETag/Last-Modified)
+CACHE_CADASTRO = Path("data/raw/Relatorio_cadop.csv")
+CACHE_CADASTRO_META = CACHE_CADASTRO.with_suffix(".meta.json")
+
+
+def _registro_como_inteiro(serie: pd.Series) -> pd.Series:
+    """Normaliza o registro ANS para `Int64` (chave inteira do merge)."""
+    if not pd.api.types.is_numeric_dtype(serie):
+        # manter só os dígitos antes de converter
+        serie = serie.astype(str).str.replace(r'\D', '', regex=True)
+    return pd.to_numeric(serie, errors='coerce').astype('Int64')
+
+
+def _baixar_cadastro() -> Path:
+    """Garante o cadastro da ANS em `CACHE_CADASTRO`, baixando só se mudou."""
+    meta = {}
+    if CACHE_CADASTRO.exists() and CACHE_CADASTRO_META.exists():
+        try:
+            meta = json.loads(CACHE_CADASTRO_META.read_text(encoding='utf-8'))
+        except Exception:
+            meta = {}
+
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        response = requests.get(URL_CADASTRO, headers=headers, verify=False, timeout=60)
+        if response.status_code == 304:
+            print(f"Cadastro inalterado no servidor — usando cache: {CACHE_CADASTRO}")
+            return CACHE_CADASTRO
+        response.raise_for_status()
+    except Exception as e:
+        if CACHE_CADASTRO.exists():
+            print(f"Falha ao baixar o cadastro ({e}) — usando cache: {CACHE_CADASTRO}")
+            return CACHE_CADASTRO
+        raise
+
+    # grava em arquivo temporário e renomeia, para nunca deixar um cache truncado
+    CACHE_CADASTRO.parent.mkdir(parents=True, exist_ok=True)
+    parcial = CACHE_CADASTRO.with_name(CACHE_CADASTRO.name + '.part')
+    parcial.write_bytes(response.content)
+    parcial.replace(CACHE_CADASTRO)
+    CACHE_CADASTRO_META.write_text(json.dumps({
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+    }), encoding='utf-8')
+    print(f"Cadastro baixado e salvo em cache: {CACHE_CADASTRO}")
+    return CACHE_CADASTRO
+
 
-def executar_enriquecimento_total():
+def _ler_cadastro(caminho: Path) -> pd.DataFrame:
+    """Lê o cadastro (sep=';') com o PyArrow, mantendo todas as colunas como texto."""
+    content = caminho.read_bytes()
+    try:
+        # tenta como utf-8 primeiro
+        content.decode('utf-8')
+        enc = 'utf8'
+    except UnicodeDecodeError:
+        # fallback para latin-1 (comum em bases da ANS)
+        enc = 'latin-1'
+
+    # nomes lidos do cabeçalho para forçar texto em todas as colunas
+    # (preserva zeros à esquerda de CNPJ/registro, como dtype=str no pandas)
+    header = content.split(b'\n', 1)[0].decode('utf-8-sig' if enc == 'utf8' else enc).rstrip('\r')
+    nomes = next(csv.reader([header], delimiter=';'))
+    try:
+        table = pa_csv.read_csv(
+            pa.BufferReader(content),
+            read_options=pa_csv.ReadOptions(column_names=nomes, skip_rows=1, encoding=enc),
+            parse_options=pa_csv.ParseOptions(delimiter=';'),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={n: pa.string() for n in nomes},
+                strings_can_be_null=True,
+            ),
+        )
+    except pa.ArrowInvalid:
+        # linhas com menos campos que o cabeçalho: o PyArrow as rejeita, o
+        # pandas completa com NaN (mantemos essas operadoras no cadastro)
+        return pd.read_csv(io.BytesIO(content), sep=';', encoding=enc, dtype=str)
+    return table.to_pandas()
+
+def executar_enriquecimento_total(df_despesas: Optional[pd.DataFrame] = None):
+    """Enriquece o consolidado; usa `df_despesas` se já estiver em memória, senão lê `INPUT_RAW`."""
     print("--- Recuperando CNPJ e Razão Social (Enriquecimento) ---")
     
     # 1. Carregar seu consolidado (que hoje só tem RegistroANS e Valores)
-    df_despesas = pd.read_csv(INPUT_RAW)
-    # Garantir que RegistroANS seja string e sem caracteres extras
+    if df_despesas is None:
+        df_despesas = pd.read_csv(INPUT_RAW)
+    else:
+        df_despesas = df_despesas.copy(deep=False)
+    # Garantir que RegistroANS seja uma chave inteira, sem caracteres extras
     if 'RegistroANS' in df_despesas.columns:
-        df_despesas['RegistroANS'] = df_despesas['RegistroANS'].astype(str).str.replace(r'\D', '', regex=True)
+        df_despesas['RegistroANS'] = _registro_como_inteiro(df_despesas['RegistroANS'])
     
-    # 2. Baixar o cadastro oficial da ANS (ler bytes e tentar decodificar corretamente)
-    response = requests.get(URL_CADASTRO, verify=False)
-    content = response.content
-    try:
-        # tenta como utf-8 primeiro
-        text = content.decode('utf-8')
-        df_cadastro = pd.read_csv(io.StringIO(text), sep=';', dtype=str)
-    except Exception:
-        # fallback para latin-1 (comum em bases da ANS)
-        df_cadastro = pd.read_csv(io.BytesIO(content), sep=';', encoding='latin-1', dtype=str)
+    # 2. Obter o cadastro oficial da ANS (cache local + GET condicional)
+    df_cadastro = _ler_cadastro(_baixar_cadastro())
     
     # Limpeza de nomes de colunas do governo
     df_cadastro.columns = [c.strip().upper() for c in df_cadastro.columns]
 
     # Corrigir mojibake em colunas de texto do cadastro
+    # (máscara vetorizada; só as células suspeitas passam pela correção em Python)
     for c in df_cadastro.select_dtypes(include=['object']).columns:
-        df_cadastro[c] = df_cadastro[c].apply(_fix_mojibake_text)
+        mask = df_cadastro[c].str.contains(_MOJIBAKE_PAT, na=False)
+        if mask.any():
+            df_cadastro.loc[mask, c] = df_cadastro.loc[mask, c].map(_fix_mojibake_text)
     
     # Detectar coluna de registro (vários nomes/erros possíveis)
     registro_col = None
@@ -85,10 +183,9 @@ def executar_enriquecimento_total():
         registro_col = df_cadastro.columns[0]
     print(f"Usando coluna de registro do cadastro: {registro_col}")
     # Criar coluna padronizada 'RegistroANS' a partir da coluna detectada
-    try:
-        df_cadastro['RegistroANS'] = df_cadastro[registro_col].astype(str).str.replace(r'\D', '', regex=True)
-    except Exception:
-        df_cadastro['RegistroANS'] = df_cadastro[registro_col].astype(str)
+    df_cadastro['RegistroANS'] = _registro_como_inteiro(df_cadastro[registro_col])
+    # registros sem número não casam com nenhuma despesa (e evitariam casar NA com NA)
+    df_cadastro = df_cadastro.dropna(subset=['RegistroANS'])
 
     # Tentar criar coluna 'RazaoSocial' a partir de possíveis rótulos
     razao_col = None
@@ -118,10 +215,18 @@ def executar_enriquecimento_total():
     df_final = df_final.rename(columns={'MODALIDADE': 'Modalidade'})
     
     # 5. Salvar o arquivo agora REALMENTE completo
-    df_final[colunas_finais].to_csv(OUTPUT_FINAL, index=False, sep=';', encoding='utf-8-sig')
+    df_final = df_final[colunas_finais]
+    df_final.to_csv(OUTPUT_FINAL, index=False, sep=';', encoding='utf-8-sig')
+    df_final.to_parquet(OUTPUT_PARQUET, engine='pyarrow', compression='zstd', row_group_size=200_000)
     
     print(f"Sucesso! Arquivo gerado com {len(df_final)} linhas.")
     print(f"Campos CNPJ e RazaoSocial agora estão preenchidos!")
+    return df_final
+
+def run(df_despesas: Optional[pd.DataFrame] = None):
+    """Executa a etapa 04 (enriquecimento com o cadastro da ANS)."""
+    return executar_enriquecimento_total(df_despesas)
+
 
 if __name__ == "__main__":
-    executar_enriquecimento_total()
\ No newline at end of file
+    run()
\ No newline at end of file
@@ -7,10 +7,23 @@ Propósito:
    em `data/output/despesas_agregadas.csv`.
 
 Estratégia:
- - Leitura em chunks para evitar uso excessivo de memória.
+ - Leitura preferencial da cópia Parquet de `dados_validados`, carregando
+   apenas as colunas usadas na agregação e já com os tipos corretos. Sem ela
+   (ou se estiver mais velha que o CSV), usamos o leitor CSV multithread do
+   PyArrow, também restrito a essas colunas.
+ - Quando executado por `scripts/run_all.py`, recebe o DataFrame enriquecido
+   da etapa 04 em memória e não relê o CSV.
+ - `RazaoSocial` e `UF` são lidas como colunas de dicionário (categóricas):
+   poucas operadoras/UFs se repetem em milhões de linhas, então o agrupamento
+   usa códigos inteiros e a memória dessas colunas cai bastante.
  - Primeiro agregamos por (RazaoSocial, UF, Ano, Trimestre) para obter soma
    por trimestre; depois agregamos por (RazaoSocial, UF) para calcular total,
-   média trimestral e desvio padrão.
+   média trimestral e desvio padrão. Ambas as agregações rodam no Arrow; só o
+   resultado final (pequeno) é convertido para pandas para gravar o CSV.
+ - O laço quente (somar cada valor no acumulador do seu grupo) é o hash
+   aggregate em C++ do Arrow, multithread e sobre floats já tipados; a
+   alternativa de fatorizar as chaves e somar com `np.bincount` mediu ~6x
+   mais lenta.
 
 Saída:
  - CSV `data/output/despesas_agregadas.csv` com colunas:
@@ -19,69 +32,137 @@ Saída:
 """
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pyarrow import csv as pa_csv
 from pathlib import Path
+from typing import Optional
 
 INPUT = Path("data/processed/dados_validados.csv")
+# cópia colunar gravada pelas etapas 03/04, preferida quando está atualizada
+INPUT_PARQUET = INPUT.with_suffix(".parquet")
 OUTPUT = Path("data/output/despesas_agregadas.csv")
 OUTPUT.parent.mkdir(parents=True, exist_ok=True)
 
-def _read_with_sep(path):
-    # tenta detectar separador comum (',' ou ';')
-    try:
-        return pd.read_csv(path, sep=',', low_memory=False)
-    except Exception:
-        return pd.read_csv(path, sep=';', low_memory=False)
-
-def executar_agregacao(chunksize=200_000):
+COLUNAS = ['RazaoSocial', 'UF', 'Ano', 'Trimestre', 'ValorDespesas']
+CHAVE_DICIONARIO = pa.dictionary(pa.int32(), pa.string())
+
+def _ler_csv(path: Path) -> pa.Table:
+    """Lê `path` com o PyArrow, apenas com as colunas usadas na agregação."""
+    # detectar separador pela amostra do arquivo
+    with open(path, encoding='utf-8', errors='ignore') as f:
+        sample = f.read(8192)
+    sep = ';' if sample.count(';') > sample.count(',') else ','
+
+    # leitura tolerante (pulando linhas malformadas), apenas com as colunas
+    # necessárias; colunas ausentes viram nulas
+    table = pa_csv.read_csv(
+        path,
+        parse_options=pa_csv.ParseOptions(delimiter=sep, invalid_row_handler=lambda row: 'skip'),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={
+                'ValorDespesas': pa.float64(),
+                # chaves de agrupamento como dicionário (equivalente Arrow do
+                # `category` do pandas): o hash é feito sobre códigos inteiros
+                'RazaoSocial': CHAVE_DICIONARIO,
+                'UF': CHAVE_DICIONARIO,
+            },
+            include_columns=COLUNAS,
+            include_missing_columns=True,
+        ),
+    )
+    # cada bloco lido tem seu próprio dicionário; unificamos antes de agrupar
+    # (equivalente ao `union_categoricals` do pandas)
+    return table.unify_dictionaries()
+
+
+def _ler_parquet(path: Path) -> pa.Table:
+    """Lê de `path` só as colunas usadas na agregação (colunas ausentes viram nulas)."""
+    existentes = set(pq.read_schema(path).names)
+    colunas = [c for c in COLUNAS if c in existentes]
+    table = pq.read_table(path, columns=colunas,
+                          read_dictionary=[c for c in ['RazaoSocial', 'UF'] if c in existentes])
+    for c in COLUNAS:
+        if c not in existentes:
+            tipo = CHAVE_DICIONARIO if c in ('RazaoSocial', 'UF') else pa.null()
+            table = table.append_column(c, pa.nulls(table.num_rows, tipo))
+    return table.select(COLUNAS).unify_dictionaries()
+
+
+def _parquet_atualizado() -> bool:
+    return INPUT_PARQUET.exists() and (
+        not INPUT.exists() or INPUT_PARQUET.stat().st_mtime >= INPUT.stat().st_mtime
+    )
+
+
+def _tabela_de_dataframe(df: pd.DataFrame) -> pa.Table:
+    """Converte o DataFrame recebido em memória para o mesmo formato de `_ler_csv`."""
+    table = pa.Table.from_pandas(df.reindex(columns=COLUNAS), preserve_index=False)
+    for c in ['RazaoSocial', 'UF']:
+        coluna = table.column(c)
+        if pa.types.is_null(coluna.type):
+            # coluna toda nula (ex.: nenhuma despesa casou com o cadastro) é inferida
+            # como `null`; um dicionário de `null` não vira Categorical no to_pandas
+            coluna = coluna.cast(pa.string())
+        if not pa.types.is_dictionary(coluna.type):
+            table = table.set_column(COLUNAS.index(c), c, pc.dictionary_encode(coluna))
+    return table.unify_dictionaries()
+
+
+def executar_agregacao(df: Optional[pd.DataFrame] = None):
+    """Agrega as despesas; usa `df` se já estiver em memória, senão lê `INPUT`."""
     print("--- Iniciando agregação de despesas (2.3) ---")
-    if not INPUT.exists():
+    if df is None and not INPUT.exists() and not INPUT_PARQUET.exists():
         print(f"Arquivo de entrada não encontrado: {INPUT}")
         return
 
-    # Ler em chunks e agregar por (RazaoSocial, UF, Ano, Trimestre)
-    quarter_parts = []
     try:
-        # detectar separador pela amostra do arquivo
-        sample = Path(INPUT).read_text(encoding='utf-8', errors='ignore')[:8192]
-        sep = ';' if sample.count(';') > sample.count(',') else ','
-
-        # leitura tolerante, pulando linhas malformadas
-        reader = pd.read_csv(INPUT, sep=sep, chunksize=chunksize, low_memory=False, on_bad_lines='skip')
-
-        for i, chunk in enumerate(reader, start=1):
-            # garantir colunas necessárias
-            for c in ['RazaoSocial', 'UF', 'Ano', 'Trimestre', 'ValorDespesas']:
-                if c not in chunk.columns:
-                    chunk[c] = None
-
-            chunk['ValorDespesas'] = pd.to_numeric(chunk['ValorDespesas'], errors='coerce').fillna(0)
-
-            grp = (
-                chunk.groupby(['RazaoSocial', 'UF', 'Ano', 'Trimestre'], dropna=False)['ValorDespesas']
-                .sum()
-                .reset_index()
-            )
-            quarter_parts.append(grp)
-            print(f"Processado chunk {i}, linhas lidas: {len(chunk)}")
-
-        if not quarter_parts:
-            print("Nenhum dado lido dos chunks.")
+        if df is not None:
+            table = _tabela_de_dataframe(df)
+        elif _parquet_atualizado():
+            print(f"Lendo {INPUT_PARQUET}")
+            table = _ler_parquet(INPUT_PARQUET)
+        else:
+            table = _ler_csv(INPUT)
+        print(f"Linhas lidas: {table.num_rows}")
+
+        if table.num_rows == 0:
+            print("Nenhum dado lido do arquivo de entrada.")
             return
 
-        quarters = pd.concat(quarter_parts, ignore_index=True)
-        # Somar novamente caso exista sobreposição entre chunks
+        valores = table.column('ValorDespesas')
+        if not pa.types.is_floating(valores.type):
+            valores = valores.cast(pa.float64())
+            table = table.set_column(COLUNAS.index('ValorDespesas'), 'ValorDespesas', valores)
+
+        # soma por trimestre em uma única passada sobre as linhas brutas
+        # (chaves nulas formam um grupo próprio, como dropna=False). Valores
+        # nulos contam como 0 direto na soma (min_count=0), sem uma passada
+        # extra de `fill_null` materializando outra cópia da coluna
         quarters = (
-            quarters.groupby(['RazaoSocial', 'UF', 'Ano', 'Trimestre'], dropna=False)['ValorDespesas']
-            .sum()
-            .reset_index()
+            table.group_by(['RazaoSocial', 'UF', 'Ano', 'Trimestre'])
+            .aggregate([('ValorDespesas', 'sum', pc.ScalarAggregateOptions(min_count=0))])
+            .rename_columns({'ValorDespesas_sum': 'ValorDespesas'})
         )
 
         # Agora agregamos por RazaoSocial + UF: total, média por trimestre e desvio padrão
-        stats = (
-            quarters.groupby(['RazaoSocial', 'UF'], dropna=False)['ValorDespesas']
-            .agg(TotalDespesas='sum', MediaPorTrimestre='mean', DesvioPadraoPorTrimestre='std', NumTrimestres='count')
-            .reset_index()
-        )
+        stats = quarters.group_by(['RazaoSocial', 'UF']).aggregate([
+            ('ValorDespesas', 'sum'),
+            ('ValorDespesas', 'mean'),
+            ('ValorDespesas', 'stddev', pc.VarianceOptions(ddof=1)),
+            ('ValorDespesas', 'count'),
+        ])
+
+        # converter apenas o resultado final (pequeno) para pandas
+        stats = stats.to_pandas().rename(columns={
+            'ValorDespesas_sum': 'TotalDespesas',
+            'ValorDespesas_mean': 'MediaPorTrimestre',
+            'ValorDespesas_stddev': 'DesvioPadraoPorTrimestre',
+            'ValorDespesas_count': 'NumTrimestres',
+        })
+        stats = stats[['RazaoSocial', 'UF', 'TotalDespesas', 'MediaPorTrimestre',
+                       'DesvioPadraoPorTrimestre', 'NumTrimestres']]
 
         # Ordenar por total decrescente
         stats = stats.sort_values('TotalDespesas', ascending=False)
@@ -89,9 +170,14 @@ def executar_agregacao(chunksize=200_000):
         # Salvar CSV
         stats.to_csv(OUTPUT, index=False, encoding='utf-8-sig')
         print(f"Agregação concluída. Arquivo salvo: {OUTPUT} (linhas: {len(stats)})")
+        return stats
 
     except Exception as e:
         print(f"Erro durante agregação: {e}")
 
+def run(df: Optional[pd.DataFrame] = None):
+    """Executa a etapa 05 (agregação por operadora/UF)."""
+    return executar_agregacao(df)
+
 if __name__ == '__main__':
-    executar_agregacao()
+    run()